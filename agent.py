@@ -1,13 +1,88 @@
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Any
+import asyncio
+import httpx
 import openai
 import os
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+# Most queued prompts dispatched in one drain of the queue
+BATCH_MAX_SIZE = 16
+
+_queue: Optional[asyncio.Queue] = None
+_client: Optional[openai.AsyncOpenAI] = None
+_sem: Optional[asyncio.Semaphore] = None
+_inflight: set = set()
+
+async def _dispatch(messages: List[Dict[str, str]], params: Dict[str, Any], future: asyncio.Future) -> None:
+    """Issue a single chat completion call and resolve its caller's future."""
+    try:
+        # Back off on 429s here rather than in the client, so the semaphore
+        # is only held while a call is in flight, never during a backoff sleep
+        async for attempt in AsyncRetrying(
+            retry=retry_if_exception_type(openai.RateLimitError),
+            wait=wait_exponential(multiplier=0.5, max=20),
+            stop=stop_after_attempt(5),
+            reraise=True
+        ):
+            with attempt:
+                async with _sem:
+                    response = await _client.chat.completions.create(messages=messages, **params)
+    except Exception as e:
+        if not future.done():
+            future.set_exception(e)
+        return
+    if not future.done():
+        future.set_result(response.choices[0].message.content)
+
+async def _batch_worker():
+    """Dispatch queued prompts concurrently, draining bursts without waiting."""
+    while True:
+        batch = [await _queue.get()]
+        # Take whatever is already queued; each item is its own API call,
+        # so holding a window open would only add latency
+        while len(batch) < BATCH_MAX_SIZE:
+            try:
+                batch.append(_queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+
+        # Don't block collection of the next batch on this one
+        task = asyncio.ensure_future(asyncio.gather(*(_dispatch(*item) for item in batch)))
+        _inflight.add(task)
+        task.add_done_callback(_inflight.discard)
+
+async def start_batch_worker(api_key: str):
+    """Start the batch worker. Must be called from the running event loop."""
+    global _queue, _client, _sem
+    _queue = asyncio.Queue()
+
+    # Cap in-flight OpenAI calls to stay under the provider's rate limits
+    _sem = asyncio.Semaphore(int(os.getenv("OPENAI_MAX_CONCURRENCY", "64")))
+
+    # Keep a warm keep-alive pool instead of a new TLS handshake per call
+    _client = openai.AsyncOpenAI(
+        api_key=api_key,
+        max_retries=0,  # tenacity in _dispatch is the only retry layer
+        http_client=httpx.AsyncClient(limits=httpx.Limits(
+            max_connections=100,
+            max_keepalive_connections=100,
+            keepalive_expiry=300
+        ))
+    )
+
+    task = asyncio.create_task(_batch_worker())
+    _inflight.add(task)
+
+async def stop_batch_worker():
+    """Cancel the batch worker and close the shared OpenAI client and its pool."""
+    for task in list(_inflight):
+        task.cancel()
+    if _client is not None:
+        await _client.close()
 
 class MCPAgent:
     def __init__(self):
         self.api_key = os.getenv("OPENAI_API_KEY")
-        if not self.api_key:
-            raise ValueError("OPENAI_API_KEY environment variable not set")
-        openai.api_key = self.api_key
 
     async def process(self, prompt: str, context: Optional[List[str]] = None, parameters: Optional[Dict] = None) -> str:
         """
@@ -30,15 +105,16 @@ class MCPAgent:
             
             messages.append({"role": "user", "content": prompt})
 
-            # Call the OpenAI API
-            response = await openai.ChatCompletion.acreate(
-                model="gpt-3.5-turbo",
-                messages=messages,
-                temperature=parameters.get("temperature", 0.7) if parameters else 0.7,
-                max_tokens=parameters.get("max_tokens", 1000) if parameters else 1000
-            )
+            params = {
+                "model": "gpt-3.5-turbo",
+                "temperature": parameters.get("temperature", 0.7) if parameters else 0.7,
+                "max_tokens": parameters.get("max_tokens", 1000) if parameters else 1000
+            }
 
-            return response.choices[0].message.content
+            # Hand off to the batch worker and wait for our result
+            future = asyncio.get_running_loop().create_future()
+            await _queue.put((messages, params, future))
+            return await future
 
         except Exception as e:
-            raise Exception(f"Error processing request: {str(e)}") 
\ No newline at end of file
+            raise Exception(f"Error processing request: {str(e)}") 
@@ -1,20 +1,30 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Depends
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 import os
 import logging
 from dotenv import load_dotenv
 import json
+import orjson
+import msgspec
 from pathlib import Path
 import re
+import codecs
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, Response, StreamingResponse
 import socket
 import sys
+import aiofiles
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, only used for large count_r inputs
+    np = None
+from agent import MCPAgent, start_batch_worker, stop_batch_worker
 
 # Configure logging
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
         logging.StreamHandler(sys.stderr)  # Log to stderr for Claude Desktop
@@ -25,18 +35,47 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-# Define allowed base directories
-ALLOWED_BASE_DIRS = [
-    str(Path.home() / "Documents"),
-    str(Path.home() / "Downloads"),
-    str(Path.home() / "Desktop"),
-    str(Path.home() / "github"),  # Added github directory
+# Shared agent instance, injected into routes via Depends
+agent = MCPAgent()
+
+# Define allowed base directories, resolved once at import
+HOME_DIR = Path.home()
+ALLOWED_BASE_DIRS = (
+    str(HOME_DIR / "Documents"),
+    str(HOME_DIR / "Downloads"),
+    str(HOME_DIR / "Desktop"),
+    str(HOME_DIR / "github"),  # Added github directory
+)
+
+# Resolved allowed directories with a trailing separator, so that
+# e.g. ~/Documentsevil does not pass as ~/Documents
+ALLOWED_PREFIXES = tuple(os.path.realpath(d) + os.sep for d in ALLOWED_BASE_DIRS)
+_ALLOWED_PREFIX_BYTES = tuple(os.fsencode(p) for p in ALLOWED_PREFIXES)
+
+# Matches the first tool name in a /process prompt
+_ROUTE_RE = re.compile(r'(read_file|count_r)', re.IGNORECASE)
+
+# Inputs longer than this are counted with NumPy when available
+COUNT_R_NUMPY_THRESHOLD = 64_000
+
+# Buffer size for file reads
+READ_CHUNK_SIZE = 1 << 20
+
+# Files larger than this are only served by the streaming route
+MAX_INLINE_FILE_SIZE = 1 << 20
+
+# Byte order marks checked before falling back to UTF-8
+BOM_ENCODINGS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
 ]
 
 app = FastAPI(
     title="MCP AI Agent Server",
     description="Multi-Component Processing AI Agent Server with Claude Desktop Integration",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -48,43 +87,58 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def startup():
+    if not agent.api_key:
+        raise ValueError("OPENAI_API_KEY environment variable not set")
+    await start_batch_worker(agent.api_key)
+
+@app.on_event("shutdown")
+async def shutdown():
+    await stop_batch_worker()
+
+# Static tool catalogue, serialized once at import
+_TOOLS_BYTES = orjson.dumps({
+    "tools": [
+        {
+            "name": "read_file",
+            "description": "Read the content of a file. Files must be in Documents, Downloads, Desktop, or github folders.",
+            "parameters": {
+                "file_path": {
+                    "type": "string",
+                    "description": "Path to the file to read"
+                }
+            }
+        },
+        {
+            "name": "count_r",
+            "description": "Count the number of 'r' characters in a string",
+            "parameters": {
+                "text": {
+                    "type": "string",
+                    "description": "Text to count 'r' characters in"
+                }
+            }
+        }
+    ]
+})
+
 # MCP Protocol endpoints
 @app.get("/mcp/health")
 async def health_check():
-    return JSONResponse(content={"status": "healthy"})
+    return ORJSONResponse(content={"status": "healthy"})
 
 @app.get("/mcp/tools")
 async def list_tools():
-    return JSONResponse(content={
-        "tools": [
-            {
-                "name": "read_file",
-                "description": "Read the content of a file. Files must be in Documents, Downloads, Desktop, or github folders.",
-                "parameters": {
-                    "file_path": {
-                        "type": "string",
-                        "description": "Path to the file to read"
-                    }
-                }
-            },
-            {
-                "name": "count_r",
-                "description": "Count the number of 'r' characters in a string",
-                "parameters": {
-                    "text": {
-                        "type": "string",
-                        "description": "Text to count 'r' characters in"
-                    }
-                }
-            }
-        ]
-    })
+    return Response(content=_TOOLS_BYTES, media_type="application/json")
 
-@app.post("/mcp/execute")
+# Echoes arbitrary client JSON, so keep the stdlib encoder: orjson
+# rejects integers outside 64 bits
+@app.post("/mcp/execute", response_class=JSONResponse)
 async def execute_mcp(request: Request):
     try:
         data = await request.json()
-        logger.debug(f"Received request: {data}")
+        logger.debug("Received request: %s", data)
         return {"status": "success", "data": data}
     except Exception as e:
         logger.error(f"Error processing request: {str(e)}")
@@ -95,11 +149,12 @@ async def execute_mcp(request: Request):
 async def health_check():
     return {"status": "healthy"}
 
-class ToolRequest(BaseModel):
+# Hot-path request bodies are parsed with msgspec in a single C pass
+class ToolRequest(msgspec.Struct):
     name: str
     parameters: Dict[str, str]
 
-class AgentRequest(BaseModel):
+class AgentRequest(msgspec.Struct):
     prompt: str
     context: Optional[List[str]] = None
     parameters: Optional[dict] = None
@@ -118,31 +173,54 @@ class MCPExecuteRequest(BaseModel):
     tool: str
     parameters: Dict[str, Any]
 
-def is_port_in_use(port: int) -> bool:
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        return s.connect_ex(('127.0.0.1', port)) == 0
+def detect_encoding(data: bytes) -> str:
+    """Guess a file's encoding from its byte order mark, defaulting to UTF-8."""
+    for bom, encoding in BOM_ENCODINGS:
+        if data.startswith(bom):
+            return encoding
+    return 'utf-8'
+
+def request_body_schema(model: type) -> Dict[str, Any]:
+    """OpenAPI requestBody for a Struct that a route decodes by hand."""
+    _, components = msgspec.json.schema_components([model])
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": components[model.__name__]}}
+        }
+    }
+
+def decode_body(body: bytes, model: type):
+    """Decode and validate a JSON request body into a msgspec Struct."""
+    try:
+        return msgspec.json.decode(body, type=model)
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+def _try_bind(port: int) -> Optional[socket.socket]:
+    """Bind a listening socket on the port, or return None if it is taken."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # On Windows SO_REUSEADDR would let us bind over a live server
+    if sys.platform != "win32":
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        s.bind(('127.0.0.1', port))
+        return s
+    except OSError:
+        s.close()
+        return None
+
+def is_path_allowed(path: str) -> bool:
+    """Check whether a resolved path lies inside one of the allowed directories."""
+    return os.fsencode(path).startswith(_ALLOWED_PREFIX_BYTES)
 
 def normalize_path(file_path: str) -> str:
     """Normalize and validate file path"""
-    # Replace environment variables
-    file_path = os.path.expandvars(file_path)
-    
-    # Convert to absolute path
-    if not os.path.isabs(file_path):
-        file_path = os.path.abspath(file_path)
-    
-    # Normalize path separators
-    file_path = os.path.normpath(file_path)
+    # Resolve symlinks on every call so a retargeted link is re-checked
+    file_path = os.path.realpath(os.path.expandvars(file_path))
     
     # Check if path is within allowed directories
-    allowed_dirs = [
-        os.path.expanduser("~/Documents"),
-        os.path.expanduser("~/Downloads"),
-        os.path.expanduser("~/Desktop"),
-        os.path.expanduser("~/github")
-    ]
-    
-    if not any(file_path.startswith(d) for d in allowed_dirs):
+    if not is_path_allowed(file_path):
         raise HTTPException(
             status_code=403,
             detail="File must be in Documents, Downloads, Desktop, or github directory"
@@ -150,54 +228,59 @@ def normalize_path(file_path: str) -> str:
     
     return file_path
 
-def read_file(file_path: str) -> str:
+def resolve_file(file_path: str) -> str:
+    """Validate a requested file path and return its absolute path."""
+    # Normalize the path; rejects anything outside the allowed directories
+    abs_path = normalize_path(file_path)
+    logger.debug("Normalized file path: %s", abs_path)
+    
+    # Check if file exists
+    if not os.path.exists(abs_path):
+        raise HTTPException(
+            status_code=404,
+            detail=f"File not found: {file_path}\nPlease check:\n1. The file exists\n2. The path is correct\n3. You have permission to access it"
+        )
+    
+    # Check if it's a file (not a directory)
+    if not os.path.isfile(abs_path):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Path is not a file: {file_path}"
+        )
+
+    return abs_path
+
+async def read_file(file_path: str) -> str:
     """Read the content of a file with security checks."""
     try:
-        # Normalize the path
-        file_path = normalize_path(file_path)
-        logger.debug(f"Normalized file path: {file_path}")
-        
-        # Convert to absolute path
-        abs_path = os.path.abspath(file_path)
-        logger.debug(f"Absolute file path: {abs_path}")
-        
-        # Check if path is allowed
-        if not is_path_allowed(abs_path):
-            allowed_dirs = "\n".join(ALLOWED_BASE_DIRS)
-            raise HTTPException(
-                status_code=403,
-                detail=f"Access to {file_path} is not allowed. File must be in one of these directories:\n{allowed_dirs}"
-            )
-        
-        # Check if file exists
-        if not os.path.exists(abs_path):
-            raise HTTPException(
-                status_code=404,
-                detail=f"File not found: {file_path}\nPlease check:\n1. The file exists\n2. The path is correct\n3. You have permission to access it"
-            )
-        
-        # Check if it's a file (not a directory)
-        if not os.path.isfile(abs_path):
+        abs_path = resolve_file(file_path)
+
+        # Large files go through the streaming route instead of JSON
+        if os.path.getsize(abs_path) > MAX_INLINE_FILE_SIZE:
             raise HTTPException(
-                status_code=400,
-                detail=f"Path is not a file: {file_path}"
+                status_code=413,
+                detail=f"File {file_path} is larger than {MAX_INLINE_FILE_SIZE} bytes. Use GET /tools/read_file/stream?file_path=... instead"
             )
         
-        # Try different encodings
-        encodings = ['utf-8', 'latin-1', 'cp1252']
-        for encoding in encodings:
-            try:
-                with open(abs_path, 'r', encoding=encoding) as file:
-                    content = file.read()
-                    logger.debug(f"Successfully read file with {encoding} encoding")
-                    return content
-            except UnicodeDecodeError:
-                continue
-                
-        raise HTTPException(
-            status_code=400,
-            detail=f"Could not read file {file_path} with any of the supported encodings"
-        )
+        # Read the raw bytes once, in 1MB chunks
+        data = bytearray()
+        async with aiofiles.open(abs_path, 'rb', buffering=READ_CHUNK_SIZE) as file:
+            while True:
+                chunk = await file.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                data += chunk
+
+        # Pick the encoding up front instead of re-reading per attempt
+        encoding = detect_encoding(data)
+        try:
+            content = data.decode(encoding)
+        except UnicodeDecodeError:
+            # latin-1 maps every byte, so this never fails
+            encoding = 'latin-1'
+            content = data.decode(encoding)
+        logger.debug("Successfully read file with %s encoding", encoding)
+        return content
             
     except HTTPException:
         raise
@@ -210,55 +293,85 @@ def read_file(file_path: str) -> str:
 
 def count_r(text: str) -> int:
     """Count the number of 'r' characters in a string."""
-    return text.lower().count('r')
+    if np is not None and len(text) > COUNT_R_NUMPY_THRESHOLD:
+        # Vectorized byte compare; 'r' and 'R' survive the ASCII encode
+        buf = np.frombuffer(text.encode('ascii', 'ignore'), dtype=np.uint8)
+        return int(np.count_nonzero((buf == ord('r')) | (buf == ord('R'))))
+
+    # Two C-level counts, no lowercased copy of the text
+    return text.count('r') + text.count('R')
 
 @app.get("/")
 async def root():
     logger.debug("Received request to root endpoint")
     return {"message": "Welcome to MCP AI Agent Server"}
 
-@app.post("/process", response_model=AgentResponse)
-async def process_request(request: AgentRequest):
+@app.post("/process", response_model=AgentResponse, openapi_extra=request_body_schema(AgentRequest))
+async def process_request(raw: Request, mcp_agent: MCPAgent = Depends(lambda: agent)):
+    request = decode_body(await raw.body(), AgentRequest)
     try:
-        logger.debug(f"Received request with prompt: {request.prompt}")
+        logger.debug("Received request with prompt: %s", request.prompt)
         
         # Parse the prompt to determine which tool to use
-        if "read_file" in request.prompt.lower():
+        match = _ROUTE_RE.search(request.prompt)
+        tool = match.group(1).lower() if match else None
+
+        if tool == "read_file":
             # Extract file path from prompt
-            file_path = request.prompt.split("read_file")[1].strip()
-            result = read_file(file_path)
+            file_path = request.prompt[match.end():].strip()
+            result = await read_file(file_path)
             return AgentResponse(
                 response=result,
                 metadata={"status": "success", "tool": "read_file"}
             )
-        elif "count_r" in request.prompt.lower():
+        elif tool == "count_r":
             # Extract text from prompt
-            text = request.prompt.split("count_r")[1].strip()
+            text = request.prompt[match.end():].strip()
             count = count_r(text)
             return AgentResponse(
                 response=f"Number of 'r' characters: {count}",
                 metadata={"status": "success", "tool": "count_r"}
             )
         else:
+            # No tool requested, hand the prompt to the AI agent
+            result = await mcp_agent.process(request.prompt, request.context, request.parameters)
             return AgentResponse(
-                response="Invalid tool request. Available tools: read_file, count_r",
-                metadata={"status": "error", "error": "invalid_tool"}
+                response=result,
+                metadata={"status": "success", "tool": "agent"}
             )
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing request: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/tools/{tool_name}", response_model=AgentResponse)
-async def execute_tool(tool_name: str, request: ToolRequest):
+async def iter_file(abs_path: str):
+    """Yield a file's bytes in READ_CHUNK_SIZE chunks."""
+    async with aiofiles.open(abs_path, 'rb') as file:
+        while True:
+            chunk = await file.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+@app.get("/tools/read_file/stream")
+async def stream_file(file_path: str):
+    abs_path = resolve_file(file_path)
+    # Raw bytes: the encoding is not known without reading the whole file
+    return StreamingResponse(iter_file(abs_path), media_type="application/octet-stream")
+
+@app.post("/tools/{tool_name}", response_model=AgentResponse, openapi_extra=request_body_schema(ToolRequest))
+async def execute_tool(tool_name: str, raw: Request):
+    request = decode_body(await raw.body(), ToolRequest)
     try:
-        logger.debug(f"Executing tool: {tool_name} with parameters: {request.parameters}")
+        logger.debug("Executing tool: %s with parameters: %s", tool_name, request.parameters)
         
         if tool_name == "read_file":
             file_path = request.parameters.get("file_path")
             if not file_path:
                 raise HTTPException(status_code=400, detail="file_path parameter is required")
-            result = read_file(file_path)
+            result = await read_file(file_path)
             return AgentResponse(
                 response=result,
                 metadata={"status": "success", "tool": "read_file"}
@@ -285,8 +398,11 @@ if __name__ == "__main__":
     port = 8081
     max_attempts = 5
     
+    # Keep the bound socket and hand it to uvicorn, so no other process
+    # can grab the port between the check and startup
     for attempt in range(max_attempts):
-        if not is_port_in_use(port):
+        sock = _try_bind(port)
+        if sock is not None:
             break
         logger.warning(f"Port {port} is in use, trying next port...")
         port += 1
@@ -296,4 +412,7 @@ if __name__ == "__main__":
     
     logger.info(f"Starting server on port {port}")
     import uvicorn
-    uvicorn.run("main:app", host="127.0.0.1", port=port, log_level="debug") 
\ No newline at end of file
+    # uvloop has no Windows build; fall back to the stdlib loop there
+    loop = "asyncio" if sys.platform == "win32" else "uvloop"
+    config = uvicorn.Config("main:app", host="127.0.0.1", port=port, loop=loop, http="httptools", log_level="info")
+    uvicorn.Server(config).run(sockets=[sock])
\ No newline at end of file